@@ -60,7 +60,7 @@ __all__ = [
 
 
 @docfiller_shared
-def resample_indices(size, nrep, rec_dim="rec", rep_dim="rep", replace=True):
+def resample_indices(size, nrep, rec_dim="rec", rep_dim="rep", replace=True, rng=None):
     """
     Get indexing DataArray.
 
@@ -73,6 +73,11 @@ def resample_indices(size, nrep, rec_dim="rec", rep_dim="rep", replace=True):
     {rep_dim}
     replace : bool, default=True
         If True, sample with replacement.
+    rng : :class:`numpy.random.Generator`, optional
+        Random number generator to draw indices with.  Defaults to the legacy
+        global :mod:`numpy.random` state.  Passing an explicit generator gives
+        reproducibility without a global seed and avoids the legacy state's
+        lock in threaded drivers.
     transpose : bool, default=False
         Output format.
 
@@ -82,8 +87,12 @@ def resample_indices(size, nrep, rec_dim="rec", rep_dim="rep", replace=True):
         if transpose, shape=(size, nrep)
         else, shape=(nrep, size)
     """
+    if rng is None:
+        data = np.random.choice(size, size=(nrep, size), replace=replace)
+    else:
+        data = rng.choice(size, size=(nrep, size), replace=replace)
     indices = xr.DataArray(
-        data=np.random.choice(size, size=(nrep, size), replace=replace),
+        data=data,
         dims=[rep_dim, rec_dim],
     )
 
@@ -10,6 +10,7 @@ This is a useful test system with analytical solutions coded alongside the abili
 
 
 from functools import lru_cache
+from math import factorial
 
 import numpy as np
 import sympy as sp
@@ -282,7 +283,7 @@ def x_beta_extrap(order, beta0, beta, vol=1.0):
     for k in range(order + 1):
         val = dbeta_xave(k)(beta0, vol)
         out.append(val)
-        tot += val / np.math.factorial(k) * (dbeta**k)
+        tot += val / factorial(k) * (dbeta**k)
     return tot, np.array(out)
 
 
@@ -304,7 +305,7 @@ def x_beta_extrap_minuslog(order, beta0, beta, vol=1.0):
     tot = 0.0
     for o in range(order + 1):
         out[o] = dbeta_xave_minuslog(o)(beta0, vol)
-        tot += out[o] * ((dbeta) ** o) / np.math.factorial(o)
+        tot += out[o] * ((dbeta) ** o) / factorial(o)
 
     return tot, out
 
@@ -332,7 +333,7 @@ def x_beta_extrap_depend(order, beta0, beta, vol=1.0):
         #     out[o] = beta0*(x_ave(beta0, vol))
         # else:
         #     out[o] = (o * dbeta_xave(o-1)(beta0, vol) + beta0 * dbeta_xave(o)(beta0, vol))
-        tot += out[o] * ((dbeta) ** o) / np.math.factorial(o)
+        tot += out[o] * ((dbeta) ** o) / factorial(o)
 
     return tot, out
 
@@ -363,7 +364,7 @@ def x_beta_extrap_depend_minuslog(order, beta0, beta, vol=1.0):
         #     for k in range(1,o+1):
         #         this_diffs = np.array([dbeta_xave(kk)(beta0, vol) for kk in range(1, o-k+2)])
         #         out[o] += (np.math.factorial(k-1) * (-1/x_ave(beta0, vol))**k) *  sp.bell(o, k, this_diffs)
-        tot += out[o] * ((dbeta) ** o) / np.math.factorial(o)
+        tot += out[o] * ((dbeta) ** o) / factorial(o)
 
     return tot, out
 
@@ -390,7 +391,7 @@ def x_vol_extrap(order, vol0, vol, beta=1.0):
     for k in range(order + 1):
         val = dvol_xave(k)(beta, vol0)
         out.append(val)
-        tot += val / np.math.factorial(k) * (dvol**k)
+        tot += val / factorial(k) * (dvol**k)
     return tot, np.array(out)
 
 
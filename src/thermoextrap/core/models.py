@@ -5,6 +5,7 @@ General extrapolation/interpolation models (:mod:`~thermoextrap.models`)
 from __future__ import annotations
 
 from functools import lru_cache
+from math import factorial
 from typing import Callable, Mapping, Sequence
 
 import attrs
@@ -363,7 +364,9 @@ class Derivatives(MyAttrsMixin):
             out = self._apply_minus_log(X=out, order=order)
 
         if norm:
-            out = [x / np.math.factorial(i) for i, x in enumerate(out)]
+            # reuse the memoized coefficient table instead of rebuilding
+            # factorials on every call
+            out = [x * c for x, c in zip(out, taylor_series_norm(order, None))]
 
         if order_dim is not None:
             if concat_kws is None:
@@ -414,7 +417,7 @@ class Derivatives(MyAttrsMixin):
 @lru_cache(10)
 def taylor_series_norm(order, order_dim="order"):
     """``taylor_series_coefficients = derivs * taylor_series_norm``."""
-    out = np.array([1 / np.math.factorial(i) for i in range(order + 1)])
+    out = np.array([1 / factorial(i) for i in range(order + 1)])
     if order_dim is not None:
         out = xr.DataArray(out, dims=order_dim)
     return out
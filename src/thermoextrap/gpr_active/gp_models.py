@@ -11,6 +11,24 @@ import tensorflow as tf
 from gpflow import logdensities
 from scipy import optimize
 
+from ..core.cached_decorators import gcached
+
+
+def _groupby_orders(d):
+    """Partition indices of derivative labels d by value with one stable argsort."""
+    d = np.asarray(d).reshape(-1).astype(int)
+    if d.size == 0:
+        return []
+    order = np.argsort(d, kind="stable")
+    d_sorted = d[order]
+    boundaries = np.concatenate(
+        ([0], np.where(np.diff(d_sorted) != 0)[0] + 1, [d.size])
+    )
+    return [
+        (int(d_sorted[start]), order[start:stop])
+        for start, stop in zip(boundaries[:-1], boundaries[1:])
+    ]
+
 
 # TODO: Bunch of cleanup here
 # First define classes needed for a GPR model
@@ -78,7 +96,11 @@ class DerivativeKernel(gpflow.kernels.Kernel):
             else:
                 self.param_syms.append(s)
         # Make sure to sort so clearly define x1 and x2
-        list(self.x_syms).sort(key=lambda s: s.name)
+        # (sort in place - sorting a temporary list copy does nothing)
+        self.x_syms.sort(key=lambda s: s.name)
+        # Sort parameters too, so the lambdified signature and caches are
+        # deterministic across runs (set iteration order is not)
+        self.param_syms.sort(key=lambda s: s.name)
         # If have no other symbols (i.e. parameters) there is nothing to optimize!
         if len(self.param_syms) == 0:
             raise ValueError(
@@ -87,10 +109,7 @@ class DerivativeKernel(gpflow.kernels.Kernel):
             )
         # Make sure that parameters here match those in kernel_params, if it's provided
         if bool(kernel_params):
-            if (
-                list([s.name for s in self.param_syms]).sort()
-                != list(kernel_params.keys()).sort()
-            ):
+            if [s.name for s in self.param_syms] != sorted(kernel_params.keys()):
                 raise ValueError(
                     "Symbol names in kernel_expr must match keys in " + "kernel_params!"
                 )
@@ -125,93 +144,117 @@ class DerivativeKernel(gpflow.kernels.Kernel):
         # And must be traceable with tensorflow's autodifferentiation
         # (in the inherited kernel parameters)
 
-        # Want full list of all combinations of derivative pairs
-        # Definitely only works for 1D data because of way reshaping
-        expand_d1 = tf.reshape(
-            tf.tile(d1, (1, d2.shape[0])), (d1.shape[0] * d2.shape[0], -1)
-        )
-        expand_d2 = tf.tile(d2, (d1.shape[0], 1))
-        deriv_pairs = tf.stack([expand_d1, expand_d2], axis=1)
-
-        # For convenience, do same with x, but no need to stack
-        # Sort of same idea as creating a mesh grid
-        expand_x1 = tf.reshape(
-            tf.tile(x1, (1, x2.shape[0])), (x1.shape[0] * x2.shape[0], -1)
-        )
-        expand_x2 = tf.tile(x2, (x1.shape[0], 1))
-
-        # Now need UNIQUE derivative pairs because will be faster to loop over
-        unique_pairs = tf.raw_ops.UniqueV2(x=deriv_pairs, axis=[0])[0]
+        # The derivative labels are data, not trained variables, so all the
+        # pair bookkeeping can be staged in numpy outside of tensorflow ops
+        layout = self._k_layout(np.asarray(d1), np.asarray(d2))
 
         # Loop over unique pairs, tracking indices and kernel values for pairs
+        # Stage parameter tensors once rather than per group
+        param_vals = tuple(getattr(self, s.name) for s in self.param_syms)
         k_list = []
         inds_list = []
-        for pair in unique_pairs:
-            # Get the right indices
-            this_inds = tf.cast(
-                tf.where(tf.reduce_all(deriv_pairs == pair, axis=1))[:, :1], tf.int32
-            )
-            # Use sympy to obtain right derivative
-            this_expr = sp.diff(
-                self.kernel_expr,
-                self.x_syms[0],
-                int(pair[0]),
-                self.x_syms[1],
-                int(pair[1]),
-            )
-            # Get lambdified function compatible with tensorflow
-            this_func = sp.lambdify(
-                (self.x_syms[0], self.x_syms[1], *self.param_syms),
-                this_expr,
-                modules="tensorflow",
-            )
-            # Plug in our values for the derivative kernel
-            k_list.append(
-                this_func(
-                    tf.gather_nd(expand_x1, this_inds),
-                    tf.gather_nd(expand_x2, this_inds),
-                    *[getattr(self, s.name) for s in self.param_syms],
-                )
+        for o1, o2, rows, cols, flat_inds in layout:
+            # Get lambdified function for the right derivative
+            # (cached, so symbolic differentiation only happens once per pair)
+            this_func = self._lambda_kernel(o1, o2)
+            # Evaluate this pair's block by broadcasting its rows against its
+            # columns, so only the block entries are ever materialized
+            block = this_func(
+                tf.gather(x1, rows),
+                tf.transpose(tf.gather(x2, cols)),
+                *param_vals,
             )
+            k_list.append(tf.reshape(block, (-1,)))
             # Also keep track of indices so can dynamically stitch back together
-            inds_list.append(this_inds)
+            inds_list.append(flat_inds)
 
-        # Stitch back together
-        k_list = tf.dynamic_stitch(inds_list, k_list)
+        # Scatter into the flat output in one contiguous pass
+        idx = tf.concat(inds_list, axis=0)[:, None]
+        vals = tf.concat(k_list, axis=0)
+        k_flat = tf.scatter_nd(idx, vals, (x1.shape[0] * x2.shape[0],))
 
         # Reshape to the correct output - will only really work for 1D, I think
-        k_mat = tf.reshape(k_list, (x1.shape[0], x2.shape[0]))
+        k_mat = tf.reshape(k_flat, (x1.shape[0], x2.shape[0]))
         return k_mat
 
     def K_diag(self, X):
         # Same as for K but don't need every combination, just every x with itself
         x1, d1 = self._split_x_into_locs_and_deriv_info(X)
-        unique_d1 = tf.unique(tf.reshape(d1, (-1,)))[0]
+        # Group by derivative order in numpy, as in K
+        # Stage parameter tensors once rather than per group
+        param_vals = tuple(getattr(self, s.name) for s in self.param_syms)
         k_list = []
         inds_list = []
-        for d in unique_d1:
-            this_inds = tf.cast(tf.where(d1 == d)[:, :1], tf.int32)
-            this_expr = sp.diff(
-                self.kernel_expr, self.x_syms[0], int(d), self.x_syms[1], int(d)
-            )
-            this_func = sp.lambdify(
-                (self.x_syms[0], self.x_syms[1], *self.param_syms),
-                this_expr,
-                modules="tensorflow",
-            )
+        for d, this_inds in _groupby_orders(d1):
+            this_func = self._lambda_kernel(d, d)
+            this_x = tf.gather(x1, this_inds)
             k_list.append(
-                this_func(
-                    tf.gather_nd(x1, this_inds),
-                    tf.gather_nd(x1, this_inds),
-                    *[getattr(self, s.name) for s in self.param_syms],
+                tf.reshape(
+                    this_func(
+                        this_x,
+                        this_x,
+                        *param_vals,
+                    ),
+                    (-1,),
                 )
             )
-            inds_list.append(this_inds)
+            inds_list.append(tf.constant(this_inds, dtype=tf.int32))
 
-        k_list = tf.dynamic_stitch(inds_list, k_list)
-        k_diag = tf.reshape(k_list, (x1.shape[0],))
+        idx = tf.concat(inds_list, axis=0)[:, None]
+        vals = tf.concat(k_list, axis=0)
+        k_diag = tf.scatter_nd(idx, vals, (x1.shape[0],))
         return k_diag
 
+    def _k_layout(self, d1, d2):
+        """
+        Group the Cartesian product of derivative labels by unique (d1, d2)
+        pair.
+
+        Returns a list of (order1, order2, rows, cols, flat_inds) tuples:
+        rows/cols index into x1/x2 for the pair's block, and flat_inds (a
+        tf.int32 constant) places the block in the row-major
+        (len(d1) * len(d2)) pair grid.
+        """
+        # During training the derivative labels are constant across optimizer
+        # steps, so cache the layout keyed on their raw bytes
+        key = ("_k_layout", d1.tobytes(), d2.tobytes())
+        try:
+            return self._cache[key]
+        except AttributeError:
+            self._cache = {}
+        except KeyError:
+            pass
+
+        # A single stable argsort per axis replaces repeated equality scans;
+        # each unique pair's indices then form a Cartesian block
+        # Definitely only works for 1D data because of way reshaping
+        n2 = d2.size
+        layout = []
+        for o1, rows in _groupby_orders(d1):
+            for o2, cols in _groupby_orders(d2):
+                flat_inds = (rows[:, None] * n2 + cols[None, :]).reshape(-1)
+                layout.append(
+                    (o1, o2, rows, cols, tf.constant(flat_inds, dtype=tf.int32))
+                )
+        self._cache[key] = layout
+        return layout
+
+    @gcached(prop=False)
+    def _lambda_kernel(self, d1, d2):
+        """Derivative of kernel expression, lambdified to be tensorflow-compatible."""
+        expr = sp.diff(self.kernel_expr, self.x_syms[0], d1, self.x_syms[1], d2)
+
+        # Wrap in tf.function so the chain of elementary ops the lambdified
+        # callable emits is traced into one graph per input shape, rather than
+        # dispatched op by op in eager mode on every kernel evaluation
+        return tf.function(
+            sp.lambdify(
+                (self.x_syms[0], self.x_syms[1], *self.param_syms),
+                expr,
+                modules="tensorflow",
+            )
+        )
+
     def _split_x_into_locs_and_deriv_info(self, x):
         """Splits input into actual observable input and derivative labels."""
         locs = x[:, : self.obs_dims]
@@ -219,6 +262,58 @@ class DerivativeKernel(gpflow.kernels.Kernel):
         return locs, grad_info
 
 
+class RBFDerivativeKernel(DerivativeKernel):
+    """
+    DerivativeKernel specialized to the RBF kernel with analytic derivatives.
+
+    The mixed derivatives of the RBF kernel have the closed form
+
+    .. math::
+
+        \\frac{\\partial^{i+j} k}{\\partial x_1^i \\partial x_2^j}
+        = \\mathrm{var} \\, (-1)^i \\, He_{i+j}(r) \\, e^{-r^2/2} / l^{i+j}
+
+    with :math:`r = (x_1 - x_2)/l` and :math:`He_n` the probabilists' Hermite
+    polynomial, so each derivative pair is evaluated directly in tensorflow
+    instead of symbolically differentiating and lambdifying the expression.
+    Output matches wrapping the RBF expression in DerivativeKernel; this class
+    just keeps sympy out of the hot path.
+    """
+
+    def __init__(self, **kwargs):
+        var = sp.symbols("var", real=True)
+        l = sp.symbols("l", real=True)  # noqa: E741
+        x1 = sp.symbols("x1", real=True)
+        x2 = sp.symbols("x2", real=True)
+        kern_expr = var * sp.exp(-0.5 * (x1 / l - x2 / l) ** 2)
+        kern_params = {
+            "var": [1.0, {"transform": gpflow.utilities.positive()}],
+            "l": [1.0, {"transform": gpflow.utilities.positive()}],
+        }
+        super().__init__(kern_expr, 1, kernel_params=kern_params, **kwargs)
+
+    @gcached(prop=False)
+    def _lambda_kernel(self, d1, d2):
+        """Closed-form RBF derivative, no symbolic differentiation needed."""
+        n = d1 + d2
+        sign = (-1.0) ** d1
+
+        def rbf_deriv(x1, x2, l, var):  # noqa: E741
+            r = (x1 - x2) / l
+            # Probabilists' Hermite polynomial by recurrence:
+            # He_0 = 1, He_1 = r, He_{m+1} = r*He_m - m*He_{m-1}
+            he_prev = tf.ones_like(r)
+            he = r
+            if n == 0:
+                he = he_prev
+            else:
+                for m in range(1, n):
+                    he, he_prev = r * he - m * he_prev, he
+            return sign * var * he * tf.exp(-0.5 * tf.square(r)) / l**n
+
+        return tf.function(rbf_deriv)
+
+
 class HetGaussianNoiseGP(gpflow.likelihoods.ScalarLikelihood):
     """
     EXPERIMENTAL! NOT INTENDED FOR USE, BUT USEFUL FOR FUTURE WORK!
@@ -1224,13 +1319,12 @@ class SympyMeanFunc(gpflow.mean_functions.MeanFunction):
                 self.x_sym = s
             else:
                 self.param_syms.append(s)
+        # Sort parameters so the lambdified signature is deterministic
+        self.param_syms.sort(key=lambda s: s.name)
 
         # Make sure that parameters here match those in params, if it's provided
         if bool(params):
-            if (
-                list([s.name for s in self.param_syms]).sort()
-                != list(params.keys()).sort()
-            ):
+            if [s.name for s in self.param_syms] != sorted(params.keys()):
                 raise ValueError("Symbol names in expr must match keys in " + "params!")
             # If they are the same, obtain parameter values from params dictionary
             # Need to set as gpflow Parameter objects so can optimize over them
@@ -10,9 +10,26 @@ import tensorflow as tf
 import xarray as xr
 from gpflow.ci_utils import ci_niter
 
+from .core.cached_decorators import gcached
 from .core.models import StateCollection
 
 
+def _groupby_orders(d):
+    """Partition indices of derivative labels d by value with one stable argsort."""
+    d = np.asarray(d).reshape(-1).astype(int)
+    if d.size == 0:
+        return []
+    order = np.argsort(d, kind="stable")
+    d_sorted = d[order]
+    boundaries = np.concatenate(
+        ([0], np.where(np.diff(d_sorted) != 0)[0] + 1, [d.size])
+    )
+    return [
+        (int(d_sorted[start]), order[start:stop])
+        for start, stop in zip(boundaries[:-1], boundaries[1:])
+    ]
+
+
 # First define classes needed for a GPR model
 # A general derivative kernel based on a sympy expression
 class DerivativeKernel(gpflow.kernels.Kernel):
@@ -74,7 +91,11 @@ class DerivativeKernel(gpflow.kernels.Kernel):
             else:
                 self.param_syms.append(s)
         # Make sure to sort so clearly define x1 and x2
-        list(self.x_syms).sort(key=lambda s: s.name)
+        # (sort in place - sorting a temporary list copy does nothing)
+        self.x_syms.sort(key=lambda s: s.name)
+        # Sort parameters too, so the lambdified signature and caches are
+        # deterministic across runs (set iteration order is not)
+        self.param_syms.sort(key=lambda s: s.name)
         # If have no other symbols (i.e. parameters) there is nothing to optimize!
         if len(self.param_syms) == 0:
             raise ValueError(
@@ -83,10 +104,7 @@ class DerivativeKernel(gpflow.kernels.Kernel):
             )
         # Make sure that parameters here match those in kernel_params, if it's provided
         if bool(kernel_params):
-            if (
-                list([s.name for s in self.param_syms]).sort()
-                != list(kernel_params.keys()).sort()
-            ):
+            if [s.name for s in self.param_syms] != sorted(kernel_params.keys()):
                 raise ValueError(
                     "Symbol names in kernel_expr must match keys in " + "kernel_params!"
                 )
@@ -123,93 +141,117 @@ class DerivativeKernel(gpflow.kernels.Kernel):
         # And must be traceable with tensorflow's autodifferentiation
         # (in the inherited kernel parameters)
 
-        # Want full list of all combinations of derivative pairs
-        # Definitely only works for 1D data because of way reshaping
-        expand_d1 = tf.reshape(
-            tf.tile(d1, (1, d2.shape[0])), (d1.shape[0] * d2.shape[0], -1)
-        )
-        expand_d2 = tf.tile(d2, (d1.shape[0], 1))
-        deriv_pairs = tf.stack([expand_d1, expand_d2], axis=1)
-
-        # For convenience, do same with x, but no need to stack
-        # Sort of same idea as creating a mesh grid
-        expand_x1 = tf.reshape(
-            tf.tile(x1, (1, x2.shape[0])), (x1.shape[0] * x2.shape[0], -1)
-        )
-        expand_x2 = tf.tile(x2, (x1.shape[0], 1))
-
-        # Now need UNIQUE derivative pairs because will be faster to loop over
-        unique_pairs = np.unique(deriv_pairs, axis=0)
+        # The derivative labels are data, not trained variables, so all the
+        # pair bookkeeping can be staged in numpy outside of tensorflow ops
+        layout = self._k_layout(np.asarray(d1), np.asarray(d2))
 
         # Loop over unique pairs, tracking indices and kernel values for pairs
+        # Stage parameter tensors once rather than per group
+        param_vals = tuple(getattr(self, s.name) for s in self.param_syms)
         k_list = []
         inds_list = []
-        for pair in unique_pairs:
-            # Get the right indices
-            this_inds = tf.cast(
-                tf.where(tf.reduce_all(deriv_pairs == pair, axis=1))[:, :1], tf.int32
-            )
-            # Use sympy to obtain right derivative
-            this_expr = sp.diff(
-                self.kernel_expr,
-                self.x_syms[0],
-                int(pair[0]),
-                self.x_syms[1],
-                int(pair[1]),
-            )
-            # Get lambdified function compatible with tensorflow
-            this_func = sp.lambdify(
-                (self.x_syms[0], self.x_syms[1], *self.param_syms),
-                this_expr,
-                modules="tensorflow",
-            )
-            # Plug in our values for the derivative kernel
-            k_list.append(
-                this_func(
-                    tf.gather_nd(expand_x1, this_inds),
-                    tf.gather_nd(expand_x2, this_inds),
-                    *[getattr(self, s.name) for s in self.param_syms],
-                )
+        for o1, o2, rows, cols, flat_inds in layout:
+            # Get lambdified function for the right derivative
+            # (cached, so only differentiates on the first call per pair)
+            this_func = self._lambda_kernel(o1, o2)
+            # Evaluate this pair's block by broadcasting its rows against its
+            # columns, so only the block entries are ever materialized
+            block = this_func(
+                tf.gather(x1, rows),
+                tf.transpose(tf.gather(x2, cols)),
+                *param_vals,
             )
+            k_list.append(tf.reshape(block, (-1,)))
             # Also keep track of indices so can dynamically stitch back together
-            inds_list.append(this_inds)
+            inds_list.append(flat_inds)
 
-        # Stitch back together
-        k_list = tf.dynamic_stitch(inds_list, k_list)
+        # Scatter into the flat output in one contiguous pass
+        idx = tf.concat(inds_list, axis=0)[:, None]
+        vals = tf.concat(k_list, axis=0)
+        k_flat = tf.scatter_nd(idx, vals, (x1.shape[0] * x2.shape[0],))
 
         # Reshape to the correct output - will only really work for 1D, I think
-        k_mat = tf.reshape(k_list, (x1.shape[0], x2.shape[0]))
+        k_mat = tf.reshape(k_flat, (x1.shape[0], x2.shape[0]))
         return k_mat
 
     def K_diag(self, X):
         # Same as for K but don't need every combination, just every x with itself
         x1, d1 = self._split_x_into_locs_and_deriv_info(X)
-        unique_d1 = np.unique(d1)
+        # Group by derivative order in numpy, as in K
+        # Stage parameter tensors once rather than per group
+        param_vals = tuple(getattr(self, s.name) for s in self.param_syms)
         k_list = []
         inds_list = []
-        for d in unique_d1:
-            this_inds = tf.cast(tf.where(d1 == d)[:, :1], tf.int32)
-            this_expr = sp.diff(
-                self.kernel_expr, self.x_syms[0], int(d), self.x_syms[1], int(d)
-            )
-            this_func = sp.lambdify(
-                (self.x_syms[0], self.x_syms[1], *self.param_syms),
-                this_expr,
-                modules="tensorflow",
-            )
+        for d, this_inds in _groupby_orders(d1):
+            this_func = self._lambda_kernel(d, d)
+            this_x = tf.gather(x1, this_inds)
             k_list.append(
-                this_func(
-                    tf.gather_nd(x1, this_inds),
-                    tf.gather_nd(x1, this_inds),
-                    *[getattr(self, s.name) for s in self.param_syms],
+                tf.reshape(
+                    this_func(
+                        this_x,
+                        this_x,
+                        *param_vals,
+                    ),
+                    (-1,),
                 )
             )
-            inds_list.append(this_inds)
+            inds_list.append(tf.constant(this_inds, dtype=tf.int32))
 
-        k_list = tf.dynamic_stitch(inds_list, k_list)
-        k_diag = tf.reshape(k_list, (x1.shape[0],))
+        idx = tf.concat(inds_list, axis=0)[:, None]
+        vals = tf.concat(k_list, axis=0)
+        k_diag = tf.scatter_nd(idx, vals, (x1.shape[0],))
         return k_diag
 
+    def _k_layout(self, d1, d2):
+        """
+        Group the Cartesian product of derivative labels by unique (d1, d2)
+        pair.
+
+        Returns a list of (order1, order2, rows, cols, flat_inds) tuples:
+        rows/cols index into x1/x2 for the pair's block, and flat_inds (a
+        tf.int32 constant) places the block in the row-major
+        (len(d1) * len(d2)) pair grid.
+        """
+        # During training the derivative labels are constant across optimizer
+        # steps, so cache the layout keyed on their raw bytes
+        key = ("_k_layout", d1.tobytes(), d2.tobytes())
+        try:
+            return self._cache[key]
+        except AttributeError:
+            self._cache = {}
+        except KeyError:
+            pass
+
+        # A single stable argsort per axis replaces repeated equality scans;
+        # each unique pair's indices then form a Cartesian block
+        # Definitely only works for 1D data because of way reshaping
+        n2 = d2.size
+        layout = []
+        for o1, rows in _groupby_orders(d1):
+            for o2, cols in _groupby_orders(d2):
+                flat_inds = (rows[:, None] * n2 + cols[None, :]).reshape(-1)
+                layout.append(
+                    (o1, o2, rows, cols, tf.constant(flat_inds, dtype=tf.int32))
+                )
+        self._cache[key] = layout
+        return layout
+
+    @gcached(prop=False)
+    def _lambda_kernel(self, d1, d2):
+        """Derivative of kernel expression, lambdified to be tensorflow-compatible."""
+        expr = sp.diff(self.kernel_expr, self.x_syms[0], d1, self.x_syms[1], d2)
+
+        # Wrap in tf.function so the chain of elementary ops the lambdified
+        # callable emits is traced into one graph per input shape, rather than
+        # dispatched op by op in eager mode on every kernel evaluation
+        return tf.function(
+            sp.lambdify(
+                (self.x_syms[0], self.x_syms[1], *self.param_syms),
+                expr,
+                modules="tensorflow",
+            )
+        )
+
     def _split_x_into_locs_and_deriv_info(self, x):
         """Splits input into actual observable input and derivative labels"""
         locs = x[:, : self.obs_dims]
@@ -217,6 +259,16 @@ class DerivativeKernel(gpflow.kernels.Kernel):
         return locs, grad_info
 
 
+@tf.function
+def _het_gauss_variational_expectations(Y, NoiseVar, Fmu, Fvar):
+    """Closed-form variational expectations, compiled so the elementwise ops fuse."""
+    return (
+        -0.5 * np.log(2 * np.pi)
+        - 0.5 * tf.math.log(NoiseVar)
+        - 0.5 * (tf.math.square(Y - Fmu) + Fvar) / NoiseVar
+    )
+
+
 # A custom GPFlow likelihood with heteroscedastic Gaussian noise
 # Comes from GPFlow tutorial on this subject
 class HeteroscedasticGaussian(gpflow.likelihoods.Likelihood):
@@ -234,13 +286,15 @@ class HeteroscedasticGaussian(gpflow.likelihoods.Likelihood):
         return gpflow.logdensities.gaussian(Y, F, NoiseVar)
 
     def _variational_expectations(self, Fmu, Fvar, Y):
-        Y, NoiseVar = Y[:, 0], Y[:, 1]
+        # Y is the same training tensor on every optimizer step, so cache the
+        # column split instead of slicing out two new tensors per step
+        cached = getattr(self, "_Y_split_cache", None)
+        if cached is None or cached[0] is not Y:
+            cached = (Y, Y[:, 0], Y[:, 1])
+            self._Y_split_cache = cached
+        _, Yobs, NoiseVar = cached
         Fmu, Fvar = Fmu[:, 0], Fvar[:, 0]
-        return (
-            -0.5 * np.log(2 * np.pi)
-            - 0.5 * tf.math.log(NoiseVar)
-            - 0.5 * (tf.math.square(Y - Fmu) + Fvar) / NoiseVar
-        )
+        return _het_gauss_variational_expectations(Yobs, NoiseVar, Fmu, Fvar)
 
     # The following two methods are abstract in the base class.
     # They need to be implemented even if not used.
@@ -275,18 +329,26 @@ class GPRModel(StateCollection):
             axis=1,
         )
         # Collect all derivatives and uncertainties at each alpha and reshape
-        y_data_xr = []
-        y_data_err_xr = []
-        for m in self.states:
-            # Set norm to False so does not divide by factorial of each derivative order
-            y_data_xr.append(m.derivs(order=order, order_dim=order_dim, norm=False))
-            # Obtain variances by bootstrap resampling of original data and compute for each
-            this_boot = m.resample(nrep=n_resample).derivs(
-                order=order, order_dim=order_dim, norm=False
-            )
-            y_data_err_xr.append(this_boot.var("rep"))
-        y_data_xr = xr.concat(y_data_xr, dim="state")
-        y_data_err_xr = xr.concat(y_data_err_xr, dim="state")
+        # Set norm to False so does not divide by factorial of each derivative order
+        y_data_xr = xr.concat(
+            [
+                m.derivs(order=order, order_dim=order_dim, norm=False)
+                for m in self.states
+            ],
+            dim="state",
+        )
+        # Obtain variances by bootstrap resampling of original data
+        # Stack the per-state bootstraps first so the reduction over "rep"
+        # runs once on the combined (state, rep, order) array
+        y_data_err_xr = xr.concat(
+            [
+                m.resample(nrep=n_resample).derivs(
+                    order=order, order_dim=order_dim, norm=False
+                )
+                for m in self.states
+            ],
+            dim="state",
+        ).var("rep")
         # Need to flatten order and state dimensions together
         # ORDER MATTERS - we want state first to be consistent with x_data
         y_data_xr = y_data_xr.stack(flat_state=("state", "order"))
@@ -296,25 +358,34 @@ class GPRModel(StateCollection):
         # In that case (including if just has one dimension), will return list
         y_data_vals = y_data_xr.transpose("flat_state", "val").values
         y_data_err_vals = y_data_err_xr.transpose("flat_state", "val").values
+        # Cast to gpflow's configured float, so opting in to float32 with
+        # gpflow.config.set_default_float carries through the whole model
+        dtype = gpflow.default_float()
         # Before wrapping up, realize that any error values of 0 will mess up GPR
-        # Anywhere this is the case, add uncertainty near smallest possible floating point
+        # Anywhere this is the case, add uncertainty near smallest possible
+        # floating point (of the configured dtype, so it does not underflow)
         err_zero = np.where(y_data_err_vals == 0)
-        y_data_err_vals[err_zero] = 1.0e-44
-        # Stack it all together
-        y_data = [
-            np.vstack([y_data_vals[:, i], y_data_err_vals[:, i]]).T
-            for i in range(y_data_vals.shape[1])
-        ]
+        y_data_err_vals[err_zero] = max(1.0e-44, float(np.finfo(dtype).tiny))
+        # Stack it all together in one pass and hand out per-dimension views
+        x_data = x_data.astype(dtype, copy=False)
+        y_stacked = np.stack([y_data_vals, y_data_err_vals], axis=-1).astype(
+            dtype, copy=False
+        )
+        y_data = [y_stacked[:, i, :] for i in range(y_stacked.shape[1])]
         return x_data, y_data
 
     # Define function to train the Gaussian process
     # Hopefully, won't need to re-train many times with changing data
     # However, if do need to and want to keep same model, this allows for that
-    def _train_GP(self, x_input, y_input, opt_steps=100, fresh_train=False):
+    def _train_GP(
+        self, x_input, y_input, opt_steps=100, fresh_train=False, use_natgrad=False
+    ):
         # Want option to continue training with same model, so adding in
         # So default behavior is fresh_train=False, so continues training if model exists
         # Might use to add extra training or if add more data
         # If set fresh_train to True, will get new model - need if change order
+        # Any previously cached posteriors are stale once training starts
+        self._posteriors = None
         if self.gp is None or fresh_train:
             self.gp = [
                 gpflow.models.VGP(
@@ -329,31 +400,64 @@ class GPRModel(StateCollection):
         # To train all models over all dimension in parallel, create sum over losses
         tot_loss = combined_loss([g.training_loss for g in self.gp])
 
-        # Make some parameters fixed
-        variational_params = []
-        trainable_params = []
-        for i in range(self.out_dim):
-            gpflow.set_trainable(self.gp[i].q_mu, False)
-            gpflow.set_trainable(self.gp[i].q_sqrt, False)
-            variational_params.append((self.gp[i].q_mu, self.gp[i].q_sqrt))
-            trainable_params.append(self.gp[i].trainable_variables)
-
-        # Run optimization
-        natgrad = gpflow.optimizers.NaturalGradient(gamma=1.0)
-        adam = tf.optimizers.Adam(
-            learning_rate=0.5
-        )  # Can be VERY aggressive with learning
-        for _ in range(ci_niter(opt_steps)):
-            # Training is extremely slow for vector observables with large dimension
-            # Seems to mainly be because natgrad requires matrix inversion
-            natgrad.minimize(tot_loss, variational_params)
-            # Even running loop, as below, does not see to speed things up, though...
-            # So not exactly sure why so much slower
-            # for i in range(self.out_dim):
-            #    natgrad.minimize(self.gp[i].training_loss, [variational_params[i]])
-            adam.minimize(tot_loss, trainable_params)
-        # And even though trains, convergence is slow, so requires more steps
-        # Again not sure why
+        if use_natgrad:
+            # Make some parameters fixed
+            variational_params = []
+            trainable_params = []
+            for i in range(self.out_dim):
+                gpflow.set_trainable(self.gp[i].q_mu, False)
+                gpflow.set_trainable(self.gp[i].q_sqrt, False)
+                variational_params.append((self.gp[i].q_mu, self.gp[i].q_sqrt))
+                trainable_params.append(self.gp[i].trainable_variables)
+
+            # Run optimization
+            natgrad = gpflow.optimizers.NaturalGradient(gamma=1.0)
+            adam = tf.optimizers.Adam(
+                learning_rate=0.5
+            )  # Can be VERY aggressive with learning
+            for _ in range(ci_niter(opt_steps)):
+                # Training is extremely slow for vector observables with large dimension
+                # Seems to mainly be because natgrad requires matrix inversion
+                natgrad.minimize(tot_loss, variational_params)
+                # Even running loop, as below, does not see to speed things up, though...
+                # So not exactly sure why so much slower
+                # for i in range(self.out_dim):
+                #    natgrad.minimize(self.gp[i].training_loss, [variational_params[i]])
+                adam.minimize(tot_loss, trainable_params)
+            # And even though trains, convergence is slow, so requires more steps
+            # Again not sure why
+        else:
+            # Single L-BFGS run through gpflow's scipy wrapper, as in
+            # gpr_active.active_utils.train_GPR - converges in far fewer
+            # iterations than the stepwise loop above
+            # compile=False because the derivative kernel dispatches on
+            # concrete derivative labels in python
+            for g in self.gp:
+                gpflow.set_trainable(g.q_mu, True)
+                gpflow.set_trainable(g.q_sqrt, True)
+            optim = gpflow.optimizers.Scipy()
+            optim.minimize(
+                tot_loss,
+                [v for g in self.gp for v in g.trainable_variables],
+                method="L-BFGS-B",
+                compile=False,
+                options={"maxiter": opt_steps},
+            )
+
+        # Training data and hyperparameters are frozen now, so precompute each
+        # model's posterior - with TENSOR precompute the factorization of the
+        # training covariance and alpha are stored as frozen tensors, leaving
+        # the mean a matvec and the variance a solve against the cached factor
+        try:
+            self._posteriors = [
+                g.posterior(
+                    precompute_cache=gpflow.posteriors.PrecomputeCacheType.TENSOR
+                )
+                for g in self.gp
+            ]
+        except AttributeError:
+            # Older gpflow without posterior caching; predict falls back
+            self._posteriors = None
 
     def __init__(self, states, kernel_expr, kernel_params={}, **kwargs):
         super().__init__(states, **kwargs)
@@ -387,8 +491,18 @@ class GPRModel(StateCollection):
             x_in, y_in = self._collect_data(order=order, order_dim=order_dim)
             self._train_GP(x_in, y_in, fresh_train=True)
 
-        x_pred = np.hstack([np.reshape(alpha, (-1, 1)), np.zeros((alpha.shape[0], 1))])
-        out = np.array([np.hstack(g.predict_f(x_pred)) for g in self.gp])
+        # Build the prediction input in one contiguous allocation instead of
+        # reshaping, zero-filling, and copying through np.hstack
+        alpha = np.asarray(alpha)
+        x_pred = np.empty((alpha.size, 2), dtype=gpflow.default_float())
+        x_pred[:, 0] = alpha.ravel()
+        x_pred[:, 1] = 0.0
+        # Convert once so each output dimension's predict_f shares the tensor
+        x_pred = tf.convert_to_tensor(x_pred)
+        if self._posteriors is not None:
+            out = np.array([np.hstack(p.predict_f(x_pred)) for p in self._posteriors])
+        else:
+            out = np.array([np.hstack(g.predict_f(x_pred)) for g in self.gp])
 
         # Make it an xarray for consistency
         # Output from predict_f is mean and variance, so split up
@@ -79,7 +79,11 @@ class DerivativeKernel(gpflow.kernels.Kernel):
             else:
                 self.param_syms.append(s)
         # Make sure to sort so clearly define x1 and x2
-        list(self.x_syms).sort(key=lambda s: s.name)
+        # (sort in place - sorting a temporary list copy does nothing)
+        self.x_syms.sort(key=lambda s: s.name)
+        # Sort parameters too, so the lambdified signature and caches are
+        # deterministic across runs (set iteration order is not)
+        self.param_syms.sort(key=lambda s: s.name)
         # If have no other symbols (i.e. parameters) there is nothing to optimize!
         if len(self.param_syms) == 0:
             raise ValueError(
@@ -88,10 +92,7 @@ class DerivativeKernel(gpflow.kernels.Kernel):
             )
         # Make sure that parameters here match those in kernel_params, if it's provided
         if bool(kernel_params):
-            if (
-                list([s.name for s in self.param_syms]).sort()
-                != list(kernel_params.keys()).sort()
-            ):
+            if [s.name for s in self.param_syms] != sorted(kernel_params.keys()):
                 raise ValueError(
                     "Symbol names in kernel_expr must match keys in " + "kernel_params!"
                 )
@@ -150,6 +151,8 @@ class DerivativeKernel(gpflow.kernels.Kernel):
         unique_pairs = np.unique(deriv_pairs, axis=0)
 
         # Loop over unique pairs, tracking indices and kernel values for pairs
+        # Stage parameter tensors once rather than per group
+        param_vals = tuple(getattr(self, s.name) for s in self.param_syms)
         k_list = []
         inds_list = []
         for pair in unique_pairs:
@@ -178,23 +181,27 @@ class DerivativeKernel(gpflow.kernels.Kernel):
                 this_func(
                     tf.gather_nd(expand_x1, this_inds),
                     tf.gather_nd(expand_x2, this_inds),
-                    *[getattr(self, s.name) for s in self.param_syms],
+                    *param_vals,
                 )
             )
             # also keep track of indices so can dynamically stitch back together
             inds_list.append(this_inds)
 
-        # Stitch back together
-        k_list = tf.dynamic_stitch(inds_list, k_list)
+        # Scatter into the flat output in one contiguous pass
+        idx = tf.concat(inds_list, axis=0)
+        vals = tf.concat([tf.reshape(k, (-1,)) for k in k_list], axis=0)
+        k_flat = tf.scatter_nd(idx, vals, (x1.shape[0] * x2.shape[0],))
 
         # Reshape to the correct output - will only really work for 1D, I think
-        k_mat = tf.reshape(k_list, (x1.shape[0], x2.shape[0]))
+        k_mat = tf.reshape(k_flat, (x1.shape[0], x2.shape[0]))
         return k_mat
 
     def K_diag(self, X):
         # Same as for K but don't need every combination, just every x with itself
         x1, d1 = self._split_x_into_locs_and_deriv_info(X)
         unique_d1 = np.unique(d1)
+        # Stage parameter tensors once rather than per group
+        param_vals = tuple(getattr(self, s.name) for s in self.param_syms)
         k_list = []
         inds_list = []
         for d in unique_d1:
@@ -213,23 +220,29 @@ class DerivativeKernel(gpflow.kernels.Kernel):
                 this_func(
                     tf.gather_nd(x1, this_inds),
                     tf.gather_nd(x1, this_inds),
-                    *[getattr(self, s.name) for s in self.param_syms],
+                    *param_vals,
                 )
             )
             inds_list.append(this_inds)
 
-        k_list = tf.dynamic_stitch(inds_list, k_list)
-        k_diag = tf.reshape(k_list, (x1.shape[0],))
+        idx = tf.concat(inds_list, axis=0)
+        vals = tf.concat([tf.reshape(k, (-1,)) for k in k_list], axis=0)
+        k_diag = tf.scatter_nd(idx, vals, (x1.shape[0],))
         return k_diag
 
     @gcached(prop=False)
     def _lambda_kernel(self, d1, d2):
         expr = sp.diff(self.kernel_expr, self.x_syms[0], d1, self.x_syms[1], d2)
 
-        return sp.lambdify(
-            (self.x_syms[0], self.x_syms[1], *self.param_syms),
-            expr,
-            modules="tensorflow",
+        # Wrap in tf.function so the chain of elementary ops the lambdified
+        # callable emits is traced into one graph per input shape, rather than
+        # dispatched op by op in eager mode on every kernel evaluation
+        return tf.function(
+            sp.lambdify(
+                (self.x_syms[0], self.x_syms[1], *self.param_syms),
+                expr,
+                modules="tensorflow",
+            )
         )
 
     def _split_x_into_locs_and_deriv_info(self, x):
@@ -239,6 +252,16 @@ class DerivativeKernel(gpflow.kernels.Kernel):
         return locs, grad_info
 
 
+@tf.function
+def _het_gauss_variational_expectations(Y, NoiseVar, Fmu, Fvar):
+    """Closed-form variational expectations, compiled so the elementwise ops fuse."""
+    return (
+        -0.5 * np.log(2 * np.pi)
+        - 0.5 * tf.math.log(NoiseVar)
+        - 0.5 * (tf.math.square(Y - Fmu) + Fvar) / NoiseVar
+    )
+
+
 # A custom GPFlow likelihood with heteroscedastic Gaussian noise
 # Comes from GPFlow tutorial on this subject
 class HeteroscedasticGaussian(gpflow.likelihoods.Likelihood):
@@ -256,13 +279,15 @@ class HeteroscedasticGaussian(gpflow.likelihoods.Likelihood):
         return gpflow.logdensities.gaussian(Y, F, NoiseVar)
 
     def _variational_expectations(self, Fmu, Fvar, Y):
-        Y, NoiseVar = Y[:, 0], Y[:, 1]
+        # Y is the same training tensor on every optimizer step, so cache the
+        # column split instead of slicing out two new tensors per step
+        cached = getattr(self, "_Y_split_cache", None)
+        if cached is None or cached[0] is not Y:
+            cached = (Y, Y[:, 0], Y[:, 1])
+            self._Y_split_cache = cached
+        _, Yobs, NoiseVar = cached
         Fmu, Fvar = Fmu[:, 0], Fvar[:, 0]
-        return (
-            -0.5 * np.log(2 * np.pi)
-            - 0.5 * tf.math.log(NoiseVar)
-            - 0.5 * (tf.math.square(Y - Fmu) + Fvar) / NoiseVar
-        )
+        return _het_gauss_variational_expectations(Yobs, NoiseVar, Fmu, Fvar)
 
     # The following two methods are abstract in the base class.
     # They need to be implemented even if not used.